@@ -10,6 +10,15 @@ import csv
 import termios
 import tty
 import signal
+import select
+import atexit
+import contextlib
+import functools
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Constants
 TIME_ENTRIES_FILE = os.path.expanduser('~/scripts/time_entries.json')
@@ -19,6 +28,11 @@ MASTER_CSV_FILE = os.path.join(EXPORT_DIR, 'time_tracker_log.csv')
 WEEKLY_CSV_DAY = 'Friday'
 WEEKLY_CSV_TIME = '16:00'
 MAX_DURATION = timedelta(hours=7, minutes=40)
+_DATE_FMT = '%d-%m-%Y'
+
+# Parsed once; time.strptime keeps the weekday from %A (datetime.strptime drops it)
+_TARGET_TIME = datetime.strptime(WEEKLY_CSV_TIME, '%H:%M').time()
+_TARGET_WEEKDAY = time.strptime(WEEKLY_CSV_DAY, '%A').tm_wday
 
 # Ensure necessary directories exist
 os.makedirs(EXPORT_DIR, exist_ok=True)
@@ -26,125 +40,188 @@ os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
 
 # Initialize global variables
 is_tracking = False
-start_time = None
+_start_wall = None
+_start_monotonic = None
 stop_event = threading.Event()
-auto_stop_timer = None
+# Self-pipe that signal handlers write a wake reason to, so the main loop's
+# select() wakes immediately and does the actual work outside signal context
+_stop_pipe_r, _stop_pipe_w = os.pipe()
+_WAKE_DEADLINE = b'a'
+_WAKE_EXIT = b'x'
 csv_lock = threading.Lock()
+# Reentrant so a signal handler interrupting a log() call on the same thread can't deadlock
+log_lock = threading.RLock()
+_csv_file = None
+_csv_header_written = None
+
+# Keep the log file open for the process lifetime (line buffered)
+_log_fp = open(LOG_FILE, 'a', buffering=1)
+atexit.register(_log_fp.close)
 
 def log(message):
     """Append a message to the log file with a timestamp."""
-    timestamp = datetime.now().strftime('%d-%m-%Y %H:%M:%S')
-    with open(LOG_FILE, 'a') as f:
-        f.write(f"[{timestamp}] {message}\n")
-
-def load_time_entries():
-    """Load time entries from the JSON file."""
-    if not os.path.exists(TIME_ENTRIES_FILE):
-        return []
+    timestamp = time.strftime('%d-%m-%Y %H:%M:%S')
+    with log_lock:
+        if not _log_fp.closed:
+            _log_fp.write(f"[{timestamp}] {message}\n")
+
+def _loads(data):
+    """Parse a JSON document, using orjson when it is available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _dumps(obj):
+    """Serialize an object to compact JSON, using orjson when it is available."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, separators=(',', ':'))
+
+def _is_legacy_entries_file():
+    """Return True if the entries file is a legacy JSON array, judged by its first non-space byte."""
+    try:
+        with open(TIME_ENTRIES_FILE, 'r') as f:
+            head = f.read(1)
+            while head.isspace():
+                head = f.read(1)
+    except OSError:
+        return False
+    return head == '['
+
+def _migrate_legacy_entries():
+    """Convert a legacy JSON array file to JSONL in place."""
     with open(TIME_ENTRIES_FILE, 'r') as f:
         try:
-            return json.load(f)
+            entries = _loads(f.read())
         except json.JSONDecodeError:
-            return []
-
-def save_time_entries(entries):
-    """Save time entries to the JSON file."""
-    with open(TIME_ENTRIES_FILE, 'w') as f:
-        json.dump(entries, f, indent=4)
+            entries = None
+    if entries is None:
+        # Move the unreadable file aside so new entries start a clean JSONL file
+        corrupt = TIME_ENTRIES_FILE + '.corrupt'
+        os.replace(TIME_ENTRIES_FILE, corrupt)
+        log(f"Time entries file could not be parsed; moved to {corrupt}.")
+        return
+    # Write to a temp file and rename so a crash can't leave a half-written file
+    tmp = TIME_ENTRIES_FILE + '.tmp'
+    with open(tmp, 'w') as out:
+        for entry in entries:
+            out.write(_dumps(entry) + '\n')
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp, TIME_ENTRIES_FILE)
+    log("Time entries migrated from JSON array to JSONL.")
+
+def append_time_entry_jsonl(entry):
+    """Append a single time entry as one line to the JSONL file."""
+    with open(TIME_ENTRIES_FILE, 'a') as f:
+        f.write(_dumps(entry) + '\n')
 
 def append_time_entry(entry):
-    """Append a single time entry to the JSON and CSV files."""
-    entries = load_time_entries()
-    entries.append(entry)
-    save_time_entries(entries)
+    """Append a single time entry to the JSONL and CSV files."""
+    # Only a legacy array file needs rewriting; otherwise this is a single append
+    if _is_legacy_entries_file():
+        _migrate_legacy_entries()
+    append_time_entry_jsonl(entry)
     append_to_csv(entry)
 
+def _open_master_csv():
+    """Open the master CSV file once and keep the handle for the process lifetime."""
+    global _csv_file, _csv_header_written
+    _csv_file = open(MASTER_CSV_FILE, 'a', newline='', encoding='utf-8')
+    if _csv_header_written is None:
+        # Append mode opens at end of file, so the position tells us if it is empty
+        _csv_header_written = _csv_file.tell() > 0
+    if not _csv_header_written:
+        _csv_file.write('Dato,Starttid,Sluttid,Varighed\r\n')
+        _csv_file.flush()
+        _csv_header_written = True
+
+def close_master_csv():
+    """Close the persistent master CSV file handle."""
+    global _csv_file
+    with csv_lock:
+        if _csv_file is not None:
+            _csv_file.close()
+            _csv_file = None
+
 def append_to_csv(entry):
     """Append a single time entry to the master CSV file."""
     with csv_lock:
-        file_exists = os.path.isfile(MASTER_CSV_FILE)
         try:
-            with open(MASTER_CSV_FILE, 'a', newline='', encoding='utf-8') as csvfile:
-                writer = csv.writer(csvfile)
-                if not file_exists:
-                    # Write headers if CSV doesn't exist
-                    writer.writerow(['Dato', 'Starttid', 'Sluttid', 'Varighed'])
-                writer.writerow([
-                    entry["date"],
-                    entry["start_time"],
-                    entry["end_time"],
-                    entry["duration"]
-                ])
+            if _csv_file is None:
+                _open_master_csv()
+            # All fields come from fixed strftime formats, so no quoting is needed.
+            # Rows end in \r\n to match what csv.writer produced before.
+            _csv_file.write(f'{entry["date"]},{entry["start_time"]},{entry["end_time"]},{entry["duration"]}\r\n')
+            _csv_file.flush()
         except Exception as e:
             log(f"Error appending to CSV: {e}")
             print(f"\nFejl ved opdatering af CSV: {e}")
 
-def get_key_press():
-    """Capture a single key press without waiting for Enter."""
+@contextlib.contextmanager
+def _tty_mode(set_mode):
+    """Put the terminal in the mode applied by set_mode (e.g. tty.setraw) for the block, restoring it afterwards."""
     fd = sys.stdin.fileno()
     old_settings = termios.tcgetattr(fd)
     try:
-        tty.setraw(sys.stdin.fileno())
-        ch = sys.stdin.read(1)
+        set_mode(fd)
+        yield fd
     finally:
         termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-    return ch
+
+def read_key():
+    """Read a single key press; the terminal must already be in raw or cbreak mode."""
+    return os.read(sys.stdin.fileno(), 1).decode(errors='ignore')
 
 def start_tracking():
     """Start tracking time."""
-    global is_tracking, start_time, auto_stop_timer
+    global is_tracking, _start_wall, _start_monotonic
     if is_tracking:
         print("Tidsregistrering er allerede startet.")
         return
     is_tracking = True
-    start_time = datetime.now()
-    print(f"Intern arbejde registrering startet kl. {start_time.strftime('%H:%M:%S')}.")
+    _start_wall = time.time()
+    _start_monotonic = time.monotonic()
+    print(f"Intern arbejde registrering startet kl. {time.strftime('%H:%M:%S', time.localtime(_start_wall))}.")
     log("Intern arbejde registrering startet.")
 
-    # Start the auto-stop timer as a daemon thread
-    auto_stop_timer = threading.Timer(MAX_DURATION.total_seconds(), auto_stop)
-    auto_stop_timer.daemon = True
-    auto_stop_timer.start()
-
-    # Start the timer display thread as a daemon
-    threading.Thread(target=display_timer, daemon=True).start()
-
-    # Start the key listening thread as a daemon
-    threading.Thread(target=listen_for_stop, daemon=True).start()
+    # Tick once a second via SIGALRM to update the display and enforce MAX_DURATION
+    display_timer()
+    signal.signal(signal.SIGALRM, display_timer)
+    signal.setitimer(signal.ITIMER_REAL, 1, 1)
 
 def stop_tracking(manual=False):
     """Stop tracking time."""
-    global is_tracking, start_time, auto_stop_timer
+    global is_tracking
     if not is_tracking:
         print("Ingen aktiv tidsregistrering at stoppe.")
         return
-    end_time = datetime.now()
-    duration = end_time - start_time
-    hours, remainder = divmod(int(duration.total_seconds()), 3600)
-    minutes, seconds = divmod(remainder, 60)
-
-    # Cancel the auto-stop timer if still running
-    if auto_stop_timer and auto_stop_timer.is_alive():
-        auto_stop_timer.cancel()
+    # Stop the tick timer first so its redraw can't interleave with the stop messages
+    signal.setitimer(signal.ITIMER_REAL, 0)
+    is_tracking = False
+    elapsed = int(time.monotonic() - _start_monotonic)
+    hours = elapsed // 3600
+    minutes = (elapsed // 60) % 60
+    start_lt = time.localtime(_start_wall)
+    end_clock = time.strftime('%H:%M:%S')
 
     # Log and display the stop event
     if manual:
-        print(f"\nIntern arbejde registrering stoppet manuelt kl. {end_time.strftime('%H:%M:%S')}. Varighed: {hours}h {minutes}m.")
+        print(f"\nIntern arbejde registrering stoppet manuelt kl. {end_clock}. Varighed: {hours}h {minutes}m.")
         log(f"Intern arbejde registrering stoppet manuelt. Varighed: {hours}h{minutes}m.")
     else:
-        print(f"\nIntern arbejde registrering stoppet automatisk kl. {end_time.strftime('%H:%M:%S')}. Varighed: {hours}h {minutes}m.")
+        print(f"\nIntern arbejde registrering stoppet automatisk kl. {end_clock}. Varighed: {hours}h {minutes}m.")
         log(f"Intern arbejde registrering stoppet automatisk. Varighed: {hours}h{minutes}m.")
 
-    # Append the entry to the JSON and CSV files
+    # Append the entry to the JSONL and CSV files
     entry = {
-        "date": start_time.strftime('%d-%m-%Y'),
-        "start_time": start_time.strftime('%H:%M:%S'),
-        "end_time": end_time.strftime('%H:%M:%S'),
+        "date": time.strftime(_DATE_FMT, start_lt),
+        "start_time": time.strftime('%H:%M:%S', start_lt),
+        "end_time": end_clock,
         "duration": f"{hours}h{minutes}m"
     }
     append_time_entry(entry)
 
-    is_tracking = False
     stop_event.set()
 
     # Notify user about the CSV entry
@@ -152,60 +229,102 @@ def stop_tracking(manual=False):
     print(f"Data er tilføjet til CSV: {csv_path}")
     log(f"Data er tilføjet til CSV: {csv_path}")
 
-def auto_stop():
-    """Automatically stop tracking after MAX_DURATION."""
-    stop_tracking(manual=False)
+def _wake(reason):
+    """Wake the main loop with the given reason; safe to call from a signal handler."""
+    os.write(_stop_pipe_w, reason)
 
-def display_timer():
-    """Continuously display the elapsed time."""
-    while is_tracking and not stop_event.is_set():
-        elapsed = datetime.now() - start_time
-        hours, remainder = divmod(int(elapsed.total_seconds()), 3600)
-        minutes, seconds = divmod(remainder, 60)
-        print(f"\rTid registreret: {hours:02d}:{minutes:02d}:{seconds:02d}. Tryk 'd' for at stoppe.", end='', flush=True)
-        time.sleep(1)
+def _announce_exit():
+    """Report that the script is exiting because of an exit signal."""
+    print("\nTime Tracker script afsluttet.")
+    log("Time Tracker script afsluttet.")
 
-def listen_for_stop():
-    """Listen for 'd' key press to stop tracking."""
-    while is_tracking and not stop_event.is_set():
-        key = get_key_press()
-        if key.lower() == 'd':
-            stop_tracking(manual=True)
-            break
+def display_timer(signum=None, frame=None):
+    """Display the elapsed time, requesting an automatic stop at MAX_DURATION (SIGALRM handler)."""
+    if not is_tracking:
+        return
+    elapsed = int(time.monotonic() - _start_monotonic)
+    if elapsed >= MAX_DURATION.total_seconds():
+        # Leave the stop itself to listen_for_stop, outside signal context
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        _wake(_WAKE_DEADLINE)
+        return
+    hours = elapsed // 3600
+    minutes = (elapsed // 60) % 60
+    seconds = elapsed % 60
+    print(f"\rTid registreret: {hours:02d}:{minutes:02d}:{seconds:02d}. Tryk 'd' for at stoppe.", end='', flush=True)
 
-def schedule_weekly_csv():
-    """Schedule weekly CSV generation every Friday at WEEKLY_CSV_TIME."""
+def listen_for_stop():
+    """Wait for a 'd' key press, MAX_DURATION or an exit signal, then stop tracking."""
+    # Use cbreak mode; unlike raw mode it keeps output processing and
+    # Ctrl-C, so status messages and SIGINT still behave normally.
+    with _tty_mode(tty.setcbreak) as fd:
+        while True:
+            ready, _, _ = select.select([fd, _stop_pipe_r], [], [])
+            if _stop_pipe_r in ready:
+                reason = os.read(_stop_pipe_r, 1)
+                break
+            if read_key().lower() == 'd':
+                reason = None
+                break
+    stop_tracking(manual=reason is None)
+    if reason == _WAKE_EXIT:
+        _announce_exit()
+
+def _next_weekly_csv_run():
+    """Compute and announce the next WEEKLY_CSV_DAY at WEEKLY_CSV_TIME."""
     now = datetime.now()
-    target_time = datetime.strptime(WEEKLY_CSV_TIME, '%H:%M').time()
-    days_ahead = (datetime.strptime(WEEKLY_CSV_DAY, '%A').weekday() - now.weekday()) % 7
-    if days_ahead == 0 and now.time() > target_time:
+    days_ahead = (_TARGET_WEEKDAY - now.weekday()) % 7
+    if days_ahead == 0 and now.time() > _TARGET_TIME:
         days_ahead = 7
     next_run = now + timedelta(days=days_ahead)
-    next_run = next_run.replace(hour=target_time.hour, minute=target_time.minute, second=0, microsecond=0)
-    delay = (next_run - now).total_seconds()
-
-    # Create and start the Timer as a daemon thread
-    t = threading.Timer(delay, generate_weekly_csv)
-    t.daemon = True
-    t.start()
+    next_run = next_run.replace(hour=_TARGET_TIME.hour, minute=_TARGET_TIME.minute, second=0, microsecond=0)
 
     log(f"Weekly CSV scheduled to run at {next_run.strftime('%A %H:%M:%S')}.")
     print(f"\nWeekly CSV scheduled to run at {next_run.strftime('%A %H:%M:%S')}.")
-    
+    return next_run
+
+def _weekly_csv_loop(next_run):
+    """Generate the weekly CSV at each scheduled run until stop_event is set."""
+    while not stop_event.wait((next_run - datetime.now()).total_seconds()):
+        generate_weekly_csv()
+        next_run = _next_weekly_csv_run()
+
+def schedule_weekly_csv():
+    """Start the single scheduler thread for weekly CSV generation."""
+    next_run = _next_weekly_csv_run()
+    threading.Thread(target=_weekly_csv_loop, args=(next_run,), daemon=True).start()
+
+@functools.lru_cache(maxsize=512)
+def _parse_dmy(s):
+    """Parse a day-month-year entry date, caching results for repeated dates."""
+    return datetime.strptime(s, _DATE_FMT).date()
+
+def load_weekly_rows(start_date, end_date):
+    """Read master CSV rows whose date falls between start_date and end_date (inclusive)."""
+    rows = []
+    with csv_lock:
+        if not os.path.isfile(MASTER_CSV_FILE):
+            return rows
+        with open(MASTER_CSV_FILE, 'r', newline='', encoding='utf-8') as csvfile:
+            reader = csv.reader(csvfile)
+            next(reader, None)  # Skip headers
+            for row in reader:
+                try:
+                    day = _parse_dmy(row[0])
+                except (IndexError, ValueError):
+                    continue
+                if start_date <= day <= end_date:
+                    rows.append(row[:4])
+    return rows
+
 def generate_weekly_csv():
     """Generate a weekly CSV summarizing time entries."""
     now = datetime.now()
     start_of_week = now - timedelta(days=now.weekday())  # Monday
     end_of_week = start_of_week + timedelta(days=6)     # Sunday
 
-    # Load entries
-    entries = load_time_entries()
-
-    # Filter entries for the current week
-    weekly_entries = [
-        entry for entry in entries
-        if start_of_week.strftime('%d-%m-%Y') <= entry["date"] <= end_of_week.strftime('%d-%m-%Y')
-    ]
+    # Stream this week's rows from the master CSV
+    weekly_entries = load_weekly_rows(start_of_week.date(), end_of_week.date())
 
     if not weekly_entries:
         log("Ingen tidsregistreringer fundet for denne uge.")
@@ -220,60 +339,61 @@ def generate_weekly_csv():
 
         # Write to CSV
         try:
-            with open(csv_filepath, 'w', newline='', encoding='utf-8') as csvfile:
+            with open(csv_filepath, 'w', newline='', encoding='utf-8', buffering=65536) as csvfile:
                 writer = csv.writer(csvfile)
                 writer.writerow(headers)
-                for entry in weekly_entries:
-                    writer.writerow([
-                        entry["date"],
-                        entry["start_time"],
-                        entry["end_time"],
-                        entry["duration"]
-                    ])
+                writer.writerows(weekly_entries)
             log(f"Weekly CSV generated: {csv_filename}")
             print(f"\nUge CSV fil genereret: {csv_filename} - Sti: {os.path.abspath(csv_filepath)}")
         except Exception as e:
             log(f"Error generating weekly CSV: {e}")
             print(f"\nFejl ved generering af CSV: {e}")
 
-    # Schedule the next weekly CSV
-    schedule_weekly_csv()
-
 def handle_exit(signum, frame):
     """Handle script exit gracefully."""
-    if is_tracking:
-        stop_tracking(manual=False)
-    else:
-        stop_event.set()
-    print("\nTime Tracker script afsluttet.")
-    log("Time Tracker script afsluttet.")
+    # Only wake the main loop; it stops tracking and exits outside signal context.
     # Do NOT call sys.exit(0) here to allow main thread to handle the exit
+    _wake(_WAKE_EXIT)
 
 def main():
     """Main function to run the Time Registration Tracker."""
+    # Open the master CSV once and close it cleanly on exit
+    with csv_lock:
+        _open_master_csv()
+    atexit.register(close_master_csv)
+
     # Handle exit signals
     signal.signal(signal.SIGINT, handle_exit)
     signal.signal(signal.SIGTERM, handle_exit)
 
-    # Schedule the first weekly CSV
+    # Start the weekly CSV scheduler
     schedule_weekly_csv()
 
     # Prompt to start tracking
     print("Vil du starte med at registrere intern arbejde for i dag? (y/N): ", end='', flush=True)
-    while True:
-        key = get_key_press()
-        if key.lower() == 'y':
-            start_tracking()
-            break
-        elif key.lower() == 'n':
-            print("\nTidsregistrering afbrudt.")
-            log("Tidsregistrering afbrudt af bruger.")
-            sys.exit(0)
-        else:
-            print("\nUgyldigt input. Tryk 'y' for at starte eller 'n' for at afbryde: ", end='', flush=True)
-
-    # Wait for tracking to stop
-    stop_event.wait()
+    with _tty_mode(tty.setraw) as fd:
+        while True:
+            ready, _, _ = select.select([fd, _stop_pipe_r], [], [])
+            if _stop_pipe_r in ready:
+                key = None
+                break
+            key = read_key().lower()
+            if key in ('y', 'n'):
+                break
+            # Raw mode disables output processing, so emit the carriage return explicitly
+            print("\r\nUgyldigt input. Tryk 'y' for at starte eller 'n' for at afbryde: ", end='', flush=True)
+    if key is None:
+        _announce_exit()
+        sys.exit(0)
+    if key == 'y':
+        start_tracking()
+    else:
+        print("\nTidsregistrering afbrudt.")
+        log("Tidsregistrering afbrudt af bruger.")
+        sys.exit(0)
+
+    # Wait for 'd', an automatic stop or an exit signal
+    listen_for_stop()
 
     # Exit the script
     print("Script afsluttes...")